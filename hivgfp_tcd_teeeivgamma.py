@@ -2,10 +2,22 @@
 
 from __future__ import print_function
 import sys
+import os
 import math
+import time
+import json
+import socket
+import sqlite3
+import hashlib
+import warnings
+import multiprocessing
 import numpy as np
 import scipy as sp
 from scipy import integrate
+from scipy import sparse
+from scipy import special
+from scipy import optimize
+from scipy import stats
 
 
 class _Par:
@@ -86,12 +98,32 @@ class _Par:
     _help.tend = "End time of numerical integration (h)"
     Nsteps = 1000
     _help.Nsteps = "Number of timesteps to return in [-tprior, tend] (unless timepoints specified with gettimes())"
+    reducetol = 0.0
+    _help.reducetol = "Max CDF error allowed when shortening Erlang stage chains (0 = exact)"
+    _reduction = {} # (nfull, nreduced, error) of each shortened chain
     _onset_time = 0.1 # (time for virus or drug to ramp up; 0.01h ~ 30s)
+    _rtol = None # odeint tolerances used by evolve() (None = odeint default)
+    _atol = None
+    _influxstep = 0.05 # h (grid on which evolve() records dead-cell influx)
 
 def setpars(**kwdargs):
     """Allows user to set parameter values for ODEand ICs"""
     for kw in kwdargs.keys():
-        setattr(_Par,kw,float(kwdargs[kw]))
+        if isinstance(getattr(_Par,kw,None), str):   # e.g., deathtype
+            setattr(_Par,kw,str(kwdargs[kw]))
+        else:
+            setattr(_Par,kw,float(kwdargs[kw]))
+    checkpars()
+
+def getpars():
+    """Returns a dict of the (public) parameter values"""
+    return dict((key, value) for key, value in _Par.__dict__.items()
+                if not key.startswith("_"))
+
+def _restorepars(pars):
+    """Reset the parameters to a dict returned by getpars()"""
+    for key, value in pars.items():
+        setattr(_Par,key,value)
     checkpars()
         
 def checkpars():
@@ -118,6 +150,57 @@ def checkpars():
         _Par.sigmaP = math.sqrt(_Par.tauP**2/_Par._nP)
     else:
         sys.exit()
+    # reduced-order stage chains (sigmas keep their full-order values)
+    _Par._reduction = {}
+    if (_Par.reducetol > 0):
+        for phase in ('T', 'EE', 'ER', 'EI', 'P'):
+            n = getattr(_Par, '_n' + phase)
+            m, err = _reducestages(n, _Par.reducetol)
+            _Par._reduction[phase] = (n, m, err)
+            setattr(_Par, '_n' + phase, m)
+
+# Reduced stage counts found by _reducestages(), keyed by (n, tol)
+_reducecache = {}
+
+def _reducestages(n, tol):
+    """Returns (m, err): the fewest stages m <= n whose Erlang delay
+    (with the same mean) is within tol of the n-stage one
+
+    err is the largest difference between the two CDFs.  No acyclic
+    phase-type delay with m stages has a smaller variance than the
+    m-stage Erlang, so this is also the closest m-stage fit in the
+    first two moments (the mean is exact, the variance is n/m too big).
+    """
+    if (n, tol) not in _reducecache:
+        x = np.linspace(0.0, 11.0, 4001)  # in units of the mean
+        cdf = special.gammainc(n, n*x)
+        for m in range(1, n+1):
+            err = np.max(np.abs(special.gammainc(m, m*x) - cdf))
+            if (err <= tol):
+                break
+        _reducecache[(n, tol)] = (m, err)
+    return _reducecache[(n, tol)]
+
+def reductionreport():
+    """Returns the effect of reducetol on each stage chain and the ODE
+
+    A dict with, for each phase, (nfull, nreduced, CDF error, relative
+    variance error) and, under "states", (full, reduced) ODE sizes.
+    """
+    report = {}
+    full = dict((phase, getattr(_Par, '_n' + phase))
+                for phase in ('T', 'EE', 'ER', 'EI', 'P'))
+    reduced = dict(full)
+    for phase, (n, m, err) in _Par._reduction.items():
+        full[phase] = n
+        report[phase] = (n, m, err, float(n)/m - 1.0)
+    for phase in full:
+        if phase not in report:
+            report[phase] = (full[phase], full[phase], 0.0, 0.0)
+    def size(n):
+        return n['T']*(1 + n['EE'] + n['ER'] + n['EI'] + n['P']) + 2
+    report['states'] = (size(full), size(reduced))
+    return report
 
 def _ode_expP(X, t):
     """Definition of the TEEEIV ODE (gamma-distributed tEs, exponential tP)"""
@@ -361,22 +444,183 @@ def gettimes(arr=None):
         tpoints = np.array(arr)
     return tpoints
 
-def evolve(times, X0):
+def _getode():
+    """Returns the ODE right-hand side for the current deathtype"""
+    if (_Par.deathtype == 'gamma'):
+        return _ode_gammaP
+    else:
+        return _ode_expP
+
+def evolve(times, X0, rtol=None, atol=None, accuracy=None, method=None,
+           influx=False, store=None):
     """Evolve the ODE from X0 and return array of values at times
     
     (Just a wrapper for scipy.integrate.odeint)
+
+    rtol/atol default to _Par._rtol/_Par._atol.  If accuracy is given
+    they are instead chosen (and cached) by tunetolerances().
+    method selects the solver: None or 'LSODA' (odeint), 'RK45', 'BDF'
+    or 'Radau' (solve_ivp), or 'auto' to use choosesolver().
+    With influx=True, returns (X, F) where F records the flux of live
+    cells into the two dead compartments (and those compartments) on
+    times refined to steps of at most _Par._influxstep (see redead()).
+    If store (a ResultStore) already holds this run, X is loaded from
+    it; otherwise the new X is saved there.
     """
+    if influx:
+        times = np.asarray(times, dtype=float)
+        dense = np.unique(np.r_[times, np.arange(times[0], times[-1],
+                                                 _Par._influxstep)])
+        X = evolve(dense, X0, rtol=rtol, atol=atol, accuracy=accuracy,
+                   method=method, store=store)
+        # (the ODE sees negative values as zero)
+        F = {'times': dense, 'dD': _Par.dD, 'dead': X[:,-2:].copy(),
+             'flux': Trajectory(np.clip(X, 0, None)).deathflux}
+        return X[np.searchsorted(dense, times)], F
+    if accuracy is not None:
+        rtol, atol = tunetolerances(times, X0, accuracy)
+    if rtol is None:
+        rtol = _Par._rtol
+    if atol is None:
+        atol = _Par._atol
+    if store is not None:
+        # (key on the tolerances and solver actually used)
+        if (method == 'auto'):
+            method = choosesolver(times, X0)['method']
+        settings = (rtol, atol, method or 'LSODA')
+        runid = store.lookup(times, X0, settings)
+        if runid is None:
+            X = evolve(times, X0, rtol=rtol, atol=atol, method=method)
+            store.save(times, X0, X, settings)
+            return X
+        return np.array(store.load(runid).X)
+    if (method == 'auto'):
+        choice = choosesolver(times, X0)
+        start = time.time()
+        X = evolve(times, X0, rtol=rtol, atol=atol, method=choice['method'])
+        choice['runtime'] = time.time() - start
+        return X
+    if method not in (None, 'LSODA'):
+        return _solveivp(times, X0, rtol, atol, method)
     if (_Par.deathtype == 'gamma'):
-        X = sp.integrate.odeint(_ode_gammaP, X0, times)
+        X = sp.integrate.odeint(_ode_gammaP, X0, times, rtol=rtol, atol=atol)
     else:
         #X = sp.integrate.odeint(_ode_expP, X0, times)
-        X = sp.integrate.odeint(_ode_expP, X0, times, mxstep=500000)
+        X = sp.integrate.odeint(_ode_expP, X0, times, rtol=rtol, atol=atol,
+                                mxstep=500000)
     return X
 
-def getsummarydata(times, X):
-    """Returns [total, dead, fracinf, frac-dead-of-inf]
+def _regimekey():
+    """Hashable key for the current model shape and parameter regime:
+    deathtype, stage counts and the order of magnitude of each parameter
     """
-    XX = np.zeros([times.size,4])
+    mags = []
+    for key in ('N', 'tauT', 's', 'dD', 'beta', 'V0', 'c', 'tauEE', 'dEE',
+                'fEE', 'tauER', 'dER', 'fER', 'tauEI', 'dEI', 'fEI', 'tauP',
+                'dP', 'EFAV_time', 'RALT_time'):
+        value = abs(float(getattr(_Par,key)))
+        if not np.isfinite(value):   # (e.g., a drug time of inf: no drug)
+            mags.append(str(value))
+        else:
+            mags.append(int(math.floor(math.log10(value))) if value>0 else None)
+    return (_Par.deathtype, _Par._nT, _Par._nEE, _Par._nER, _Par._nEI,
+            _Par._nP, bool(_Par.onedaydilution)) + tuple(mags)
+
+def massbalance(times, X, floor=False):
+    """Returns the cell-mass balance residual (relative to N) at times
+
+    Live plus dead plus disintegrated cells must equal the initial
+    population plus growth at rate s; the integrals for disintegration
+    and growth are taken with the trapezoid rule on times.  With
+    floor=True, returns (residual, floor), where floor estimates the
+    largest error of the trapezoid rule itself (by Richardson
+    extrapolation against every other time), below which the residual
+    says nothing about the solver.
+    """
+    def cumtrapz(t, y):
+        return np.r_[0.0, np.cumsum(0.5*(y[1:]+y[:-1])*np.diff(t))]
+    live = np.sum(X[:,:-2], axis=1)
+    dead = np.sum(X[:,-2:], axis=1)
+    disint = _Par.dD*cumtrapz(times, dead)
+    grown = _Par.s*cumtrapz(times, live)
+    residual = (live + dead + disint - live[0] - dead[0] - grown)/_Par.N
+    if not floor:
+        return residual
+    coarse = _Par.dD*cumtrapz(times[::2], dead[::2]) \
+             - _Par.s*cumtrapz(times[::2], live[::2])
+    error = np.abs((disint - grown)[::2] - coarse)/3.0
+    return residual, np.max(error)/_Par.N
+
+# Tolerances chosen by tunetolerances(), keyed by (_regimekey(), accuracy)
+_tolcache = {}
+
+def tunetolerances(times, X0, accuracy=1e-4,
+                   rtols=(1e-3, 1e-4, 1e-5, 1e-6, 1e-7, 1e-8, 1e-9, 1e-10)):
+    """Returns the loosest (rtol, atol) keeping the summary data accurate
+
+    Candidates are tried from loosest to tightest (with atol=rtol cells).
+    A candidate is rejected outright if its mass-balance residual,
+    less the quadrature floor of the check (see massbalance()), exceeds
+    accuracy; if accuracy is below that floor the check cannot resolve
+    it and is skipped (with a warning).  A candidate is accepted when
+    its summary data
+    agree with the next tighter candidate to within accuracy (total and
+    dead relative to N, frac-dead-of-inf weighted by fracinf, since it
+    is meaningless while hardly any cells are infected).  The choice is
+    cached for the current regime (see _regimekey()), so later runs
+    skip the search.
+    """
+    key = (_regimekey(), accuracy)
+    if key in _tolcache:
+        return _tolcache[key]
+    runs = {}
+    def run(rtol):
+        if rtol not in runs:
+            X = evolve(times, X0, rtol=rtol, atol=rtol)
+            XX = getsummarydata(times, X)
+            XX[:,0:2] = XX[:,0:2]/_Par.N
+            XX[:,3] = XX[:,3]*XX[:,2]
+            residual, floor = massbalance(times, X, floor=True)
+            runs[rtol] = (np.max(np.abs(residual)), floor, XX)
+        return runs[rtol]
+    choice = rtols[-1]
+    for loose, tight in zip(rtols[:-1], rtols[1:]):
+        balance, floor, summary = run(loose)
+        if (accuracy <= floor):
+            if (loose == rtols[0]):
+                warnings.warn("tunetolerances: accuracy {0} is below the "
+                              "mass-balance quadrature floor {1:.2g} of this "
+                              "time grid; using the summary check alone"
+                              .format(accuracy, floor))
+        elif (balance - floor > accuracy):
+            continue
+        if np.nanmax(np.abs(summary - run(tight)[2])) <= accuracy:
+            choice = loose
+            break
+    _tolcache[key] = (choice, choice)
+    return _tolcache[key]
+
+def _solveivp(times, X0, rtol, atol, method):
+    """evolve() with scipy.integrate.solve_ivp and the given method"""
+    f = _getode()
+    kwds = {}
+    if method in ('BDF', 'Radau'):
+        kwds['jac_sparsity'] = _jacsparsity()
+    # (odeint's default tolerances, so that solvers are comparable)
+    if rtol is None:
+        rtol = 1.49012e-8
+    if atol is None:
+        atol = 1.49012e-8
+    sol = sp.integrate.solve_ivp(lambda t, x: f(np.array(x), t),
+                                 (times[0], times[-1]), X0, method=method,
+                                 t_eval=times, rtol=rtol, atol=atol, **kwds)
+    if not sol.success:
+        raise RuntimeError("evolve: {0} failed: {1}".format(method,
+                                                            sol.message))
+    return sol.y.T
+
+def _jacsparsity():
+    """Returns the sparsity pattern of the ODE Jacobian (scipy.sparse)"""
     nT = _Par._nT
     nEE = _Par._nEE; nER = _Par._nER; nEI = _Par._nEI
     if (_Par.deathtype == 'gamma'):
@@ -385,20 +629,939 @@ def getsummarydata(times, X):
         nP = 1
     ncolL = 1+nEE+nER+nEI+nP
     ncolE = nEE+nER+nEI
-    for i in range(times.size):
-        XX[i,0] = np.sum(X[i,:]).clip(0) # total
-        XX[i,1] = np.sum(X[i,-2:]).clip(0) # dead
-        deadinf =  X[i,-1].clip(0)
-        liveinf = 0.0
-        for j in range(nT):
-            liveinf = liveinf \
-                + np.sum(X[i,(j*ncolL+(1+ncolE)):(j*ncolL+(1+ncolE+nP))])
-        XX[i,2] = (deadinf+liveinf)/XX[i,0]
-        if (liveinf+deadinf)>0:
-            XX[i,3] = deadinf/(liveinf+deadinf)
+    nlive = nT*ncolL
+    J = sparse.lil_matrix((nlive+2, nlive+2))
+    for i in range(nT):
+        for j in range(ncolL):
+            J[ncolL*i+j, ncolL*i+j] = 1
+            if (i > 0):
+                J[ncolL*i+j, ncolL*(i-1)+j] = 1  # aging
+            if (j > 1):
+                J[ncolL*i+j, ncolL*i+j-1] = 1    # next stage of infection
+        J[ncolL*i, (ncolL*i+1):(ncolL*i+1+ncolE)] = 1  # infection failure
+        J[ncolL*i+1, ncolL*i] = 1                        # infection
+    # dead cells receive from every live compartment
+    J[nlive:, :] = 1
+    return J.tocsr()
+
+def stiffness(times=None):
+    """Returns bounds on the ODE's rates and a stiffness estimate
+
+    The ODE is linear in X with the (mostly lower-triangular) generator
+    having diagonal -(deltaT + delta + d + f - s) in each phase (and
+    -(deltaT + beta V0/N - s) at most for uninfected cells), so the
+    diagonal bounds the eigenvalues.  The virus clearance c and, when
+    virus or a drug is added within times, the ramp 1/_onset_time set
+    time scales too.  The dead compartments (rate dD) drain without
+    feeding back on anything and are left out, and rates slower than
+    1/(time span) barely act within times, so the slowest rate counts
+    as at least 1/span.  Returns a dict with the fastest and slowest
+    rates ("lmax", "lmin", in 1/h), their ratio (the stiffness ratio),
+    and "index" = lmax x (time span), roughly the number of steps an
+    explicit method would need for stability.
+    """
+    if times is None:
+        times = gettimes()
+    deltaT = _Par._nT / _Par.tauT
+    rates = [deltaT + _Par.beta*_Par.V0/_Par.N - _Par.s,
+             deltaT + _Par._nEE/_Par.tauEE + _Par.dEE + _Par.fEE - _Par.s,
+             deltaT + _Par._nER/_Par.tauER + _Par.dER + _Par.fER - _Par.s,
+             deltaT + _Par._nEI/_Par.tauEI + _Par.dEI + _Par.fEI - _Par.s,
+             deltaT + _Par.dP - _Par.s, _Par.c]
+    if (_Par.deathtype == 'gamma'):
+        rates.append(deltaT + _Par._nP/_Par.tauP + _Par.dP - _Par.s)
+    if (len(_onsets(times)) > 0):
+        rates.append(1.0/_Par._onset_time)
+    rates = np.abs(rates)
+    span = times[-1] - times[0]
+    lmax = np.max(rates)
+    lmin = np.min(rates[rates > 0]) if np.any(rates > 0) else lmax
+    lmin = min(lmax, max(lmin, 1.0/span))
+    return {'lmax': lmax, 'lmin': lmin, 'ratio': lmax/lmin,
+            'index': lmax*span}
+
+def _onsets(times):
+    """Times within times at which virus (t=0) or a drug is added"""
+    return [t for t in (0.0, _Par.EFAV_time, _Par.RALT_time)
+            if times[0] <= t <= times[-1]]
+
+# Solver choices made by choosesolver(), keyed by _regimekey()
+_solvercache = {}
+
+def choosesolver(times, X0, probe=False, methods=('RK45','LSODA','BDF','Radau')):
+    """Returns a dict with the solver "method" for the current regime
+
+    By default the method follows from the stiffness ratio of
+    stiffness(): explicit RK45 below 1e2, LSODA (odeint) below 1e5,
+    and the implicit BDF (or Radau, for small systems) with the sparse
+    Jacobian beyond that.  With probe=True each of methods is instead
+    timed from times[0] through a tenth of the time span past the last
+    addition of virus or drug (see _onsets()), and the fastest is chosen.
+    The choice (with the stiffness estimate, probe timings and, after
+    evolve(method='auto'), the last run time) is cached per regime.
+    """
+    key = _regimekey()
+    if (key in _solvercache) \
+       and ((not probe) or ('timings' in _solvercache[key])):
+        return _solvercache[key]
+    choice = {'stiffness': stiffness(times)}
+    if probe:
+        tprobe = max([times[0]] + _onsets(times)) \
+                 + 0.1*(times[-1] - times[0])
+        short = times[:max(2, np.searchsorted(times, tprobe, side='right'))]
+        choice['timings'] = {}
+        for method in methods:
+            start = time.time()
+            try:
+                evolve(short, X0, method=method)
+            except RuntimeError:
+                continue
+            choice['timings'][method] = time.time() - start
+        choice['method'] = min(choice['timings'], key=choice['timings'].get)
+    else:
+        ratio = choice['stiffness']['ratio']
+        if (ratio < 1e2):
+            choice['method'] = 'RK45'
+        elif (ratio < 1e5):
+            choice['method'] = 'LSODA'
+        elif (len(X0) > 200):
+            choice['method'] = 'BDF'
         else:
-            XX[i,3] = 0.0
-    return XX            
+            choice['method'] = 'Radau'
+    _solvercache[key] = choice
+    return choice
+
+def timeofaddition(times, X0, EFAV_times=(), RALT_times=()):
+    """Evolve a time-of-addition experiment, sharing the drug-free part
+
+    Returns (branches, X): branches lists ('EFAV', t) and ('RALT', t)
+    for each requested drug time and X[b] equals evolve(times, X0)
+    with that drug added at that time.  The trajectory without the
+    swept drug(s) is integrated once, through every drug time, and
+    each branch continues from the state at its drug time, so a
+    branch costs only its tail.  (Drugs that are not swept keep
+    their _Par times.)
+    """
+    times = np.asarray(times, dtype=float)
+    branches = [('EFAV', t) for t in EFAV_times] \
+               + [('RALT', t) for t in RALT_times]
+    saved = (_Par.EFAV_time, _Par.RALT_time)
+    try:
+        if len(EFAV_times) > 0:
+            _Par.EFAV_time = np.inf
+        if len(RALT_times) > 0:
+            _Par.RALT_time = np.inf
+        drugfree = (_Par.EFAV_time, _Par.RALT_time)
+        # drug-free run, checkpointing at each drug time
+        tbase = np.unique(np.r_[times, [t for drug, t in branches
+                                        if times[0] < t < times[-1]]])
+        Xbase = evolve(tbase, X0)
+        X = np.zeros((len(branches), times.size, Xbase.shape[1]))
+        X[:] = Xbase[np.searchsorted(tbase, times)]
+        for b, (drug, tdrug) in enumerate(branches):
+            if (tdrug >= times[-1]):
+                continue
+            _Par.EFAV_time, _Par.RALT_time = drugfree
+            setattr(_Par, drug + '_time', tdrug)
+            if (tdrug <= times[0]):
+                X[b] = evolve(times, X0)
+                continue
+            after = np.searchsorted(times, tdrug, side='right')
+            Xdrug = Xbase[np.searchsorted(tbase, tdrug)]
+            X[b,after:] = evolve(np.r_[tdrug, times[after:]], Xdrug)[1:]
+    finally:
+        _Par.EFAV_time, _Par.RALT_time = saved
+    return branches, X
+
+class Trajectory(object):
+    """Named, reshaped views of an evolve() result X (no copies)
+
+    X holds the state along its last axis, with times (and any batch
+    axes) before it.  live is X[...,:-2] viewed as [..., nT, ncolL]
+    (aging row by compartment; see _ode_expP), and uninf [..., nT],
+    EE, ER, EI and P [..., nT, nstages] and deaduninf, deadinf [...]
+    are views of X.  Totals, death fluxes and age profiles are computed
+    on first use and kept.  Stage counts and rates are those of _Par
+    when the Trajectory is created.
+    """
+    def __init__(self, X):
+        self.X = np.asarray(X)
+        self.nT = _Par._nT
+        self.nEE = _Par._nEE; self.nER = _Par._nER; self.nEI = _Par._nEI
+        self.deathtype = _Par.deathtype
+        if (self.deathtype == 'gamma'):
+            self.nP = _Par._nP
+        else:
+            self.nP = 1
+        self._rates = {'deltaT': _Par._nT/_Par.tauT,
+                       'deltaP': _Par._nP/_Par.tauP,
+                       'dEE': _Par.dEE, 'dER': _Par.dER, 'dEI': _Par.dEI,
+                       'dP': _Par.dP}
+        ncolE = self.nEE + self.nER + self.nEI
+        ncolL = 1 + ncolE + self.nP
+        self.live = self.X[...,:-2].reshape(self.X.shape[:-1]
+                                            + (self.nT, ncolL))
+        if not np.may_share_memory(self.live, self.X):
+            raise ValueError("Trajectory: X cannot be viewed without a copy")
+        self.uninf = self.live[...,0]
+        self.EE = self.live[...,1:(1+self.nEE)]
+        self.ER = self.live[...,(1+self.nEE):(1+self.nEE+self.nER)]
+        self.EI = self.live[...,(1+self.nEE+self.nER):(1+ncolE)]
+        self.P = self.live[...,(1+ncolE):]
+        self.deaduninf = self.X[...,-2]
+        self.deadinf = self.X[...,-1]
+        self._cache = {}
+
+    def total(self, phase):
+        """Cells in phase ("uninf", "EE", "ER", "EI", "P", "live" or
+        "dead") at each time, summed over aging rows and stages
+        """
+        if phase not in self._cache:
+            if (phase == 'uninf'):
+                value = np.sum(self.uninf, axis=-1)
+            elif (phase == 'live'):
+                value = np.sum(self.live, axis=(-2,-1))
+            elif (phase == 'dead'):
+                value = self.deaduninf + self.deadinf
+            elif phase in ('EE', 'ER', 'EI', 'P'):
+                value = np.sum(getattr(self, phase), axis=(-2,-1))
+            else:
+                raise ValueError("Trajectory: unknown phase " + str(phase))
+            self._cache[phase] = value
+        return self._cache[phase]
+
+    @property
+    def deathflux(self):
+        """Flux of live cells into [uninfected dead, infected dead] (cells/h)
+        """
+        if 'deathflux' not in self._cache:
+            r = self._rates
+            flux = np.zeros(self.X.shape[:-1] + (2,))
+            flux[...,0] = r['dEE']*self.total('EE') + r['dER']*self.total('ER') \
+                          + r['dEI']*self.total('EI') \
+                          + r['deltaT']*np.sum(self.live[...,-1,:-self.nP],
+                                               axis=-1)
+            flux[...,1] = r['dP']*self.total('P') \
+                          + r['deltaT']*np.sum(self.P[...,-1,:], axis=-1)
+            if (self.deathtype == 'gamma'):
+                flux[...,1] += r['deltaP']*np.sum(self.P[...,-1], axis=-1)
+            self._cache['deathflux'] = flux
+        return self._cache['deathflux']
+
+    @property
+    def ageprofile(self):
+        """Live cells in each aging row [..., nT] at each time"""
+        if 'ageprofile' not in self._cache:
+            self._cache['ageprofile'] = np.sum(self.live, axis=-1)
+        return self._cache['ageprofile']
+
+# Extra columns for evolvesummary(), as a list of (name, func(t, X))
+_reductions = []
+
+def addreduction(name, func):
+    """Register func(t, X) -> float as an extra evolvesummary() column"""
+    _reductions.append((name, func))
+
+def clearreductions():
+    """Remove all reductions registered with addreduction()"""
+    del _reductions[:]
+
+def evolvesummary(times, X0, rtol=None, atol=None):
+    """Generator form of getsummarydata(times, evolve(times, X0))
+
+    Yields (t, row) as each of times is reached, where row holds
+    [total, dead, fracinf, frac-dead-of-inf] followed by one value
+    per registered reduction (in order of registration).  Only the
+    current state is kept, so memory is O(state), not O(times x state).
+    rtol/atol default, as in evolve(), to _Par._rtol/_Par._atol and
+    then to odeint's defaults.
+    """
+    if rtol is None:
+        rtol = _Par._rtol
+    if atol is None:
+        atol = _Par._atol
+    # (odeint's default tolerances, as used by evolve())
+    if rtol is None:
+        rtol = 1.49012e-8
+    if atol is None:
+        atol = 1.49012e-8
+    f = _getode()
+    # (no copy of x: as under odeint, the ODE clips the solver's state)
+    solver = sp.integrate.ode(lambda t, x: f(x, t))
+    solver.set_integrator('lsoda', rtol=rtol, atol=atol, nsteps=500000)
+    solver.set_initial_value(np.array(X0, dtype=float), times[0])
+    X = solver.y
+    for t in times:
+        if (t != solver.t):
+            X = solver.integrate(t)
+            if not solver.successful():
+                raise RuntimeError("evolvesummary: integration failed at "
+                                   + "t={0}".format(t))
+        row = np.r_[_summary(X), [func(t, X) for name, func in _reductions]]
+        yield t, row
+
+def _summary(X):
+    """Returns [total, dead, fracinf, frac-dead-of-inf] along the last
+    axis of X (a single state, a trajectory, or a batch of trajectories)
+    """
+    X = np.asarray(X)
+    nT = _Par._nT
+    nEE = _Par._nEE; nER = _Par._nER; nEI = _Par._nEI
+    if (_Par.deathtype == 'gamma'):
+        nP = _Par._nP
+    else:
+        nP = 1
+    ncolL = 1+nEE+nER+nEI+nP
+    ncolE = nEE+nER+nEI
+    live = np.reshape(X[...,:-2], X.shape[:-1] + (nT,ncolL))
+    liveinf = np.sum(live[...,(1+ncolE):(1+ncolE+nP)], axis=(-2,-1))
+    return _summarycolumns(np.sum(X, axis=-1), X[...,-2], X[...,-1], liveinf)
+
+def _summarycolumns(total, deaduninf, deadinf, liveinf):
+    """_summary() from the total, dead and live-infected cell counts"""
+    XX = np.zeros(np.shape(total) + (4,))
+    XX[...,0] = np.clip(total, 0, None) # total
+    XX[...,1] = np.clip(deaduninf + deadinf, 0, None) # dead
+    deadinf = np.clip(deadinf, 0, None)
+    XX[...,2] = (deadinf+liveinf)/XX[...,0]
+    inf = liveinf + deadinf
+    XX[...,3] = np.where(inf>0, deadinf/np.where(inf>0, inf, 1.0), 0.0)
+    return XX
+
+def getsummarydata(times, X):
+    """Returns [total, dead, fracinf, frac-dead-of-inf]
+    """
+    return _summary(np.asarray(X)[...,:times.size,:])
+
+def _deadquadrature(times, flux, D0, dDs):
+    """Solves D' = flux - dD D from D0 on times, for each dD in dDs,
+    exactly for flux linear between times; returns [dDs, times, 2]
+    """
+    D = np.zeros((dDs.size, times.size, 2))
+    D[:,0,:] = D0
+    for k in range(times.size - 1):
+        h = times[k+1] - times[k]
+        a = dDs*h
+        # weights of flux[k], flux[k+1] in int_0^h exp(-dD(h-u)) flux(u) du
+        small = (a < 1e-6)
+        asafe = np.where(small, 1.0, a)
+        w = np.where(small, 1.0 - a/2.0, -np.expm1(-a)/asafe)
+        w1 = np.where(small, 0.5 - a/6.0, (a + np.expm1(-a))/asafe**2)
+        w0 = w - w1
+        D[:,k+1,:] = np.exp(-a)[:,None]*D[:,k,:] \
+                     + h*(w0[:,None]*flux[k] + w1[:,None]*flux[k+1])
+    return D
+
+def redead(times, X, F, dDs):
+    """Returns getsummarydata() for each dD in dDs, without a new solve
+
+    The dead compartments never feed back on the live cells, so with
+    the record F from evolve(..., influx=True) they follow from
+    D' = influx - dD D alone.  Each is the solved dead compartment
+    plus the difference between quadratures (on F's dense grid, with
+    the influx piecewise linear) for the new and the solved dD, so the
+    solved dD is reproduced exactly.  Returns [len(dDs), times, 4].
+    """
+    times = np.asarray(times, dtype=float)
+    dDs = np.asarray(dDs, dtype=float)
+    rows = np.searchsorted(F['times'], times)
+    if not np.array_equal(F['times'][np.minimum(rows, F['times'].size-1)],
+                          times):
+        raise ValueError("redead: times are not those given to evolve()")
+    trajectory = Trajectory(X)
+    D0 = F['dead'][0]
+    D = F['dead'] \
+        + _deadquadrature(F['times'], F['flux'], D0, dDs) \
+        - _deadquadrature(F['times'], F['flux'], D0, np.array([F['dD']]))
+    D = D[:,rows,:]
+    return _summarycolumns(trajectory.total('live') + D[...,0] + D[...,1],
+                           D[...,0], D[...,1], trajectory.total('P'))
+
+#====== Archive of results ======
+class ResultStore(object):
+    """On-disk archive of evolve() results, indexed by parameter values
+
+    path/index.sqlite has one row per run with its key (a hash of the
+    parameters, stage counts, times, X0 and solver settings), one
+    column per public parameter and stage count, and indexed columns
+    for the evolve() settings (rtol, atol, method; NULL for the
+    defaults) and a hash of X0 (X0hash).  Each run's arrays
+    are in path/<key>/: times.npy, one .npy per summary column and the
+    trajectory in chunks of rows (X_00000.npy, ...), all of which are
+    loaded memory-mapped by load().
+    """
+    columns = ('total', 'dead', 'fracinf', 'deadfracinf')
+    stages = ('_nT', '_nEE', '_nER', '_nEI', '_nP')
+    settings = (('rtol', 'REAL'), ('atol', 'REAL'), ('method', 'TEXT'),
+                ('X0hash', 'TEXT'))
+
+    def __init__(self, path, chunk=1000):
+        self.path = path
+        self.chunk = chunk
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        conn = self._connect()
+        conn.execute("CREATE TABLE IF NOT EXISTS runs "
+                     + "(id INTEGER PRIMARY KEY, key TEXT UNIQUE, created REAL)")
+        known = set(row[1] for row in conn.execute("PRAGMA table_info(runs)"))
+        for name, sqltype in self.settings:
+            if name not in known:
+                conn.execute('ALTER TABLE runs ADD COLUMN "{0}" {1}'.format(
+                    name, sqltype))
+        conn.execute("CREATE INDEX IF NOT EXISTS runs_settings ON runs "
+                     + "(rtol, atol, method, X0hash)")
+        conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.path, 'index.sqlite'),
+                               timeout=120.0, isolation_level=None)
+
+    def _key(self, times, X0, settings):
+        # (numbers as floats, so that, e.g., 0 and 0.0 give the same key)
+        def normalize(value):
+            if isinstance(value, (bool, int, float, np.number)):
+                return float(value)
+            return value
+        pars = getpars()
+        for name in self.stages:
+            pars[name] = getattr(_Par, name)
+        pars = sorted((name, normalize(value)) for name, value in pars.items())
+        if settings is not None:
+            settings = [normalize(value) for value in settings]
+        key = hashlib.sha1(json.dumps([pars, settings],
+                                      default=str).encode())
+        key.update(np.ascontiguousarray(times, dtype=float).tobytes())
+        key.update(np.ascontiguousarray(X0, dtype=float).tobytes())
+        return key.hexdigest()
+
+    def lookup(self, times, X0, settings=None):
+        """Returns the id of the stored run for the current parameters,
+        times and X0 (and evolve() settings), or None
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT id FROM runs WHERE key=?",
+                           (self._key(times, X0, settings),)).fetchone()
+        conn.close()
+        return None if row is None else row[0]
+
+    def save(self, times, X0, X, settings=None):
+        """Store X = evolve(times, X0) under the current parameters and
+        return its id
+        """
+        key = self._key(times, X0, settings)
+        rundir = os.path.join(self.path, key)
+        if not os.path.isdir(rundir):
+            os.makedirs(rundir)
+        np.save(os.path.join(rundir, 'times.npy'), np.asarray(times))
+        XX = getsummarydata(np.asarray(times), X)
+        for k, name in enumerate(self.columns):
+            np.save(os.path.join(rundir, name + '.npy'), XX[:,k])
+        for n, start in enumerate(range(0, len(X), self.chunk)):
+            np.save(os.path.join(rundir, 'X_{0:05d}.npy'.format(n)),
+                    X[start:(start + self.chunk)])
+        pars = getpars()
+        for name in self.stages:
+            pars[name] = getattr(_Par, name)
+        rtol, atol, method = settings if settings is not None \
+                             else (None, None, None)
+        record = {'rtol': rtol, 'atol': atol, 'method': method,
+                  'X0hash': hashlib.sha1(np.ascontiguousarray(
+                      X0, dtype=float).tobytes()).hexdigest()}
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            known = set(row[1] for row in conn.execute("PRAGMA table_info(runs)"))
+            for name in sorted(pars):
+                if name not in known:
+                    conn.execute('ALTER TABLE runs ADD COLUMN "{0}" {1}'.format(
+                        name, 'TEXT' if isinstance(pars[name], str) else 'REAL'))
+            record.update(pars)
+            names = sorted(record)
+            conn.execute('INSERT OR IGNORE INTO runs (key, created, '
+                         + ', '.join('"{0}"'.format(name) for name in names)
+                         + ') VALUES (' + ', '.join('?'*(len(names) + 2))
+                         + ')', [key, time.time()]
+                         + [record[name] for name in names])
+            runid = conn.execute("SELECT id FROM runs WHERE key=?",
+                                 (key,)).fetchone()[0]
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        conn.close()
+        return runid
+
+    def query(self, **criteria):
+        """Returns the ids of runs matching all criteria, e.g.,
+        query(deathtype='gamma', beta=(a, b)) for a <= beta <= b, or
+        query(rtol=None) for runs at evolve()'s default tolerances
+        """
+        conn = self._connect()
+        stored = set(row[1] for row in conn.execute("PRAGMA table_info(runs)"))
+        conn.close()
+        known = stored | set(getpars()) | set(self.stages)
+        for name in criteria:
+            if name not in known:
+                raise ValueError("ResultStore: unknown parameter " + name)
+            if name not in stored:   # (no run has stored it yet)
+                return []
+        clauses = []
+        values = []
+        for name, value in sorted(criteria.items()):
+            if value is None:
+                clauses.append('"{0}" IS NULL'.format(name))
+            elif isinstance(value, (tuple, list, np.ndarray)):
+                if (len(value) != 2):
+                    raise ValueError("ResultStore: range for " + name
+                                     + " must be (low, high)")
+                clauses.append('"{0}" BETWEEN ? AND ?'.format(name))
+                values.extend(float(bound) for bound in value)
+            else:
+                clauses.append('"{0}" = ?'.format(name))
+                values.append(value)
+        sql = "SELECT id FROM runs"
+        if clauses:
+            sql = sql + " WHERE " + " AND ".join(clauses)
+        conn = self._connect()
+        ids = [row[0] for row in conn.execute(sql + " ORDER BY id", values)]
+        conn.close()
+        return ids
+
+    def load(self, runid):
+        """Returns the StoredRun with id runid (arrays load lazily)"""
+        conn = self._connect()
+        cursor = conn.execute("SELECT * FROM runs WHERE id=?", (runid,))
+        row = cursor.fetchone()
+        names = [description[0] for description in cursor.description]
+        conn.close()
+        if row is None:
+            raise KeyError("ResultStore: no run with id " + str(runid))
+        record = dict(zip(names, row))
+        settings = dict((name, record.pop(name))
+                        for name, sqltype in self.settings)
+        return StoredRun(os.path.join(self.path, record.pop('key')),
+                         dict((name, value) for name, value in record.items()
+                              if value is not None
+                              and name not in ('id', 'created')), settings)
+
+class StoredRun(object):
+    """A run in a ResultStore: pars (with stage counts), settings (rtol,
+    atol, method, X0hash), and memory-mapped times, summary columns
+    (column(name), summary) and trajectory (X)
+    """
+    def __init__(self, rundir, pars, settings):
+        self.rundir = rundir
+        self.pars = pars
+        self.settings = settings
+
+    def _load(self, name):
+        return np.load(os.path.join(self.rundir, name + '.npy'),
+                       mmap_mode='r')
+
+    @property
+    def times(self):
+        return self._load('times')
+
+    def column(self, name):
+        """One summary column (see ResultStore.columns)"""
+        return self._load(name)
+
+    @property
+    def summary(self):
+        """getsummarydata() of the run (read into memory)"""
+        return np.column_stack([self.column(name)
+                                for name in ResultStore.columns])
+
+    def chunks(self):
+        """The trajectory as a list of memory-mapped blocks of rows"""
+        names = sorted(name for name in os.listdir(self.rundir)
+                       if name.startswith('X_'))
+        return [self._load(name[:-4]) for name in names]
+
+    @property
+    def X(self):
+        """The trajectory (memory-mapped if stored in a single chunk)"""
+        chunks = self.chunks()
+        if (len(chunks) == 1):
+            return chunks[0]
+        return np.concatenate(chunks)
+
+#====== Experimental design ======
+def sensitivities(times, parnames, relstep=1e-3):
+    """Returns (XX, S): summary data at times and its sensitivities
+
+    S[i,k,m] = d XX[i,k] / d log(par_m) for par_m in parnames, from
+    central differences with relative step relstep (so parameters that
+    are zero have zero sensitivity).  times must start at -tprior.
+    Derivatives are taken at fixed stage counts: a parameter that
+    checkpars() rewrites (e.g., the sigmas, which snap to the stage
+    count) or whose step changes a stage count raises ValueError.
+    """
+    base = getpars()
+    stages = [getattr(_Par, '_n' + phase)
+              for phase in ('T', 'EE', 'ER', 'EI', 'P')]
+    XX = getsummarydata(times, evolve(times, getICs()))
+    S = np.zeros(XX.shape + (len(parnames),))
+    try:
+        for m, name in enumerate(parnames):
+            XXpm = []
+            for sign in (+1.0, -1.0):
+                _restorepars(base)
+                value = base[name]*(1.0 + sign*relstep)
+                setpars(**{name: value})
+                if (getattr(_Par, name) != value):
+                    raise ValueError("sensitivities: {0} is reset by "
+                                     "checkpars() and cannot be varied"
+                                     .format(name))
+                if ([getattr(_Par, '_n' + phase) for phase in
+                     ('T', 'EE', 'ER', 'EI', 'P')] != stages):
+                    raise ValueError("sensitivities: varying {0} changes a "
+                                     "stage count (try a smaller relstep)"
+                                     .format(name))
+                XXpm.append(getsummarydata(times, evolve(times, getICs())))
+            S[:,:,m] = (XXpm[0] - XXpm[1])/(2.0*relstep)
+    finally:
+        _restorepars(base)
+    return XX, S
+
+def fisherinformation(S, sigma=None, columns=(0,1,2,3)):
+    """Returns the Fisher information matrix sum_i S_i^T W S_i
+
+    S is (a subset of the rows of) the sensitivities from
+    sensitivities(), and W = diag(1/sigma^2) for the measurement noise
+    sigma of each summary column (default: 1% of N for total and dead,
+    0.01 for the two fractions).  Only the given columns are measured.
+    """
+    if sigma is None:
+        sigma = [0.01*_Par.N, 0.01*_Par.N, 0.01, 0.01]
+    columns = list(columns)
+    Sw = S[:,columns,:] / np.asarray(sigma, dtype=float)[columns,None]
+    return np.einsum('ikm,ikn->mn', Sw, Sw)
+
+def designcriterion(F, criterion='D'):
+    """Returns the D- (log det F) or A- (-trace F^-1) optimality of F
+
+    Larger is better for both; a singular F gives -inf.
+    """
+    if (criterion == 'D'):
+        sign, logdet = np.linalg.slogdet(F)
+        return logdet if (sign > 0) else -np.inf
+    elif (criterion == 'A'):
+        try:
+            return -np.trace(np.linalg.inv(F))
+        except np.linalg.LinAlgError:
+            return -np.inf
+    else:
+        raise ValueError("designcriterion: unknown criterion " + str(criterion))
+
+def _designworker(task):
+    """Best sampling times for one drug design (see optimaldesign())"""
+    pars, design, candidates, parnames, nsamples, criterion, sigma, \
+        columns = task
+    _restorepars(pars)
+    setpars(**design)
+    times = np.unique(np.r_[-1.0*_Par.tprior, candidates])
+    XX, S = sensitivities(times, parnames)
+    flat = [name for m, name in enumerate(parnames)
+            if not np.any(S[:,list(columns),m])]
+    if flat:
+        raise ValueError("optimaldesign: the measured summary data do not "
+                         "depend on " + ", ".join(flat)
+                         + " (singular Fisher information)")
+    rows = [np.searchsorted(times, t) for t in candidates]
+    # greedy selection (a small ridge makes the first picks comparable)
+    ridge = 1e-12*np.eye(len(parnames))
+    chosen = []
+    F = np.zeros((len(parnames), len(parnames)))
+    for n in range(min(nsamples, len(rows))):
+        best = None
+        for r in rows:
+            if r in chosen:
+                continue
+            value = designcriterion(F + ridge
+                                    + fisherinformation(S[r:r+1], sigma,
+                                                        columns), criterion)
+            if (best is None) or (value > best[0]):
+                best = (value, r)
+        chosen.append(best[1])
+        F = F + fisherinformation(S[best[1]:best[1]+1], sigma, columns)
+    chosen.sort()
+    _restorepars(pars)
+    return {'design': design, 'times': times[chosen], 'fisher': F,
+            'criterion': designcriterion(F, criterion)}
+
+def optimaldesign(parnames, nsamples, candidates, designs=None,
+                  criterion='D', sigma=None, columns=(0,1,2,3),
+                  processes=None):
+    """Optimize sampling times (and drug timing) for estimating parnames
+
+    For each design in designs (dicts of, e.g., EFAV_time, RALT_time and
+    onedaydilution; default: the current parameters) a single
+    trajectory and its sensitivities are computed on the candidate
+    times, and nsamples of those are chosen greedily to maximize the
+    D- or A-optimality of the Fisher information (see
+    fisherinformation()).  Designs are evaluated in parallel processes.
+    Returns the results (dicts with design, times, fisher, criterion),
+    best first.
+    """
+    if designs is None:
+        designs = [{}]
+    tasks = [(getpars(), design, np.asarray(candidates, dtype=float),
+              list(parnames), nsamples, criterion, sigma, columns)
+             for design in designs]
+    if (processes == 1) or (len(tasks) == 1):
+        results = [_designworker(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_designworker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    results.sort(key=lambda result: -result['criterion'])
+    return results
+
+#====== Profile likelihood ======
+def chisquare(data):
+    """Returns chi^2 of the model against data = (times, Y, sigma, columns)
+
+    Y[i,k] is the measured summary column columns[k] at times[i] (with
+    StdDev sigma, scalar or like Y); the model is integrated from -tprior.
+    """
+    times, Y, sigma, columns = data
+    tsim = np.unique(np.r_[-1.0*_Par.tprior, times])
+    XX = getsummarydata(tsim, evolve(tsim, getICs()))
+    rows = np.searchsorted(tsim, times)
+    return np.sum(((XX[rows][:,list(columns)] - Y)/sigma)**2)
+
+def _fitpars(data, fitpars, start):
+    """Minimize chisquare() over fitpars (as logs) from start
+
+    Each evaluation starts from the parameters as they are on entry,
+    since checkpars() snaps sigmas to the stage counts and would
+    otherwise make chi^2 depend on the values tried before.  Leaves the
+    parameters at the optimum and returns (chi2, values).
+    """
+    base = getpars()
+    def objective(logvalues):
+        _restorepars(base)
+        setpars(**dict(zip(fitpars, np.exp(logvalues))))
+        return chisquare(data)
+    result = optimize.minimize(objective, np.log(start),
+                               method='Nelder-Mead',
+                               options={'xatol': 1e-4, 'fatol': 1e-4})
+    chi2 = objective(result.x)
+    if (chi2 != result.fun):
+        raise RuntimeError("profilelikelihood: chi^2 at the optimum changed "
+                           "on re-evaluation ({0} != {1})".format(chi2,
+                                                                 result.fun))
+    return chi2, np.exp(result.x)
+
+def _profileworker(task):
+    """Profile of one parameter (see profilelikelihood())"""
+    pars, data, fitpars, name, steps, stepfactor, threshold = task
+    start = time.time()
+    _restorepars(pars)
+    others = [other for other in fitpars if other != name]
+    chi2best = chisquare(data)
+    profile = [(pars[name], chi2best)]
+    for factor in (stepfactor, 1.0/stepfactor):
+        # walk away from the optimum, warm-starting from the last point
+        _restorepars(pars)
+        warm = [pars[other] for other in others]
+        value = pars[name]
+        for n in range(steps):
+            value = value*factor
+            _restorepars(pars)
+            setpars(**{name: value})
+            if others:
+                chi2, warm = _fitpars(data, others, warm)
+            else:
+                chi2 = chisquare(data)
+            profile.append((value, chi2))
+            if (chi2 - chi2best > 2.0*threshold):
+                break
+    _restorepars(pars)
+    profile.sort()
+    values = np.array([value for value, chi2 in profile])
+    chi2s = np.array([chi2 for value, chi2 in profile])
+    # confidence interval: where the profile crosses min + threshold
+    ibest = np.argmin(chi2s)
+    limit = chi2s[ibest] + threshold
+    ci = [None, None]
+    for i in range(ibest, 0, -1):
+        if (chi2s[i-1] > limit):
+            ci[0] = np.interp(limit, [chi2s[i], chi2s[i-1]],
+                              [values[i], values[i-1]])
+            break
+    for i in range(ibest, len(values)-1):
+        if (chi2s[i+1] > limit):
+            ci[1] = np.interp(limit, [chi2s[i], chi2s[i+1]],
+                              [values[i], values[i+1]])
+            break
+    return {'par': name, 'values': values, 'chi2': chi2s,
+            'ci': tuple(ci), 'time': time.time() - start}
+
+def profilelikelihood(data, fitpars, profpars=None, steps=10,
+                      stepfactor=1.1, level=0.95, processes=None):
+    """Profile likelihoods of profpars (default: all fitpars)
+
+    The current parameters should be the best fit of fitpars to data
+    (see chisquare()).  Each profiled parameter is stepped by factors of
+    stepfactor up and down from its best value (up to steps times, or
+    until well past the confidence limit), refitting the other fitpars
+    at each step, warm-started from the previous step.  Profiles run in
+    parallel processes.  Returns a dict of par -> {values, chi2, ci,
+    time}, where ci is the (lower, upper) limit at the given confidence
+    level (None where the profile does not reach it) and time is the
+    wall time (s) of the profile.
+    """
+    if profpars is None:
+        profpars = fitpars
+    threshold = stats.chi2.ppf(level, 1)
+    tasks = [(getpars(), data, list(fitpars), name, steps, stepfactor,
+              threshold) for name in profpars]
+    if (processes == 1) or (len(tasks) == 1):
+        results = [_profileworker(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            results = pool.map(_profileworker, tasks)
+        finally:
+            pool.close()
+            pool.join()
+    return dict((result['par'], result) for result in results)
+
+#====== Sweeps over a shared job table ======
+# A sweep is a SQLite file holding one row per parameter set.  Any number
+# of workers (sweepworker(), or "-sweepworker DBFILE" on the command line),
+# on any node that can see the file, claim rows inside an exclusive
+# transaction, so each task is run once.  A claimed task carries a lease;
+# if its worker dies the lease runs out and another worker re-runs it.
+# (Use a filesystem with working POSIX locks, e.g., not NFS without lockd.)
+
+def _sweepconnect(dbfile):
+    """Open dbfile for sweep use (autocommit; transactions are explicit)"""
+    return sqlite3.connect(dbfile, timeout=120.0, isolation_level=None)
+
+def sweepinit(dbfile, parsets, times=None):
+    """Add one pending task per parameter dict in parsets to dbfile
+
+    Each task is run as setpars(**pars) on top of the worker's baseline
+    parameters.  times (default: gettimes()) are the output times.
+    Returns the number of tasks added.
+    """
+    conn = _sweepconnect(dbfile)
+    conn.execute("CREATE TABLE IF NOT EXISTS jobs ("
+                 + "id INTEGER PRIMARY KEY, pars TEXT, times TEXT, "
+                 + "status TEXT DEFAULT 'pending', worker TEXT, lease REAL, "
+                 + "attempts INTEGER DEFAULT 0, started REAL, finished REAL, "
+                 + "result TEXT, error TEXT)")
+    if times is not None:
+        times = json.dumps([float(t) for t in times])
+    conn.execute("BEGIN IMMEDIATE")
+    for pars in parsets:
+        conn.execute("INSERT INTO jobs (pars, times) VALUES (?, ?)",
+                     (json.dumps(pars, sort_keys=True), times))
+    conn.execute("COMMIT")
+    conn.close()
+    return len(parsets)
+
+def _sweepclaim(conn, worker, lease, maxattempts):
+    """Atomically claim a pending (or lease-expired) task; None if none"""
+    now = time.time()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # tasks whose last allowed attempt ran out of lease have failed
+        conn.execute("UPDATE jobs SET status='failed', finished=?, "
+                     + "error='lease expired after max attempts' "
+                     + "WHERE status='running' AND lease<? AND attempts>=?",
+                     (now, now, maxattempts))
+        row = conn.execute("SELECT id, pars, times FROM jobs "
+                           + "WHERE (status='pending' OR "
+                           + "(status='running' AND lease<?)) "
+                           + "AND attempts<? ORDER BY id LIMIT 1",
+                           (now, maxattempts)).fetchone()
+        if row is not None:
+            conn.execute("UPDATE jobs SET status='running', worker=?, "
+                         + "lease=?, attempts=attempts+1, started=? "
+                         + "WHERE id=?", (worker, now+lease, now, row[0]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+def sweepworker(dbfile, lease=3600.0, maxtasks=None, maxattempts=3):
+    """Claim and run tasks from dbfile until none remain (or maxtasks)
+
+    Each task runs evolve() and stores its times and getsummarydata().
+    lease (s) must exceed the run time of a task; a task whose worker
+    has not finished within its lease is handed out again, up to
+    maxattempts times, after which it is marked failed.  Returns the
+    number of tasks run.
+    """
+    worker = "{0}:{1}".format(socket.gethostname(), os.getpid())
+    baseline = getpars()
+    conn = _sweepconnect(dbfile)
+    ntasks = 0
+    while (maxtasks is None) or (ntasks < maxtasks):
+        row = _sweepclaim(conn, worker, lease, maxattempts)
+        if row is None:
+            break
+        jobid, pars, times = row
+        try:
+            _restorepars(baseline)
+            setpars(**json.loads(pars))
+            tpoints = gettimes(json.loads(times) if times else None)
+            X = evolve(tpoints, getICs())
+            result = json.dumps({'times': tpoints.tolist(),
+                                 'summary': getsummarydata(tpoints,X).tolist()})
+            conn.execute("UPDATE jobs SET status='done', result=?, "
+                         + "finished=? WHERE id=? AND worker=?",
+                         (result, time.time(), jobid, worker))
+        except (Exception, SystemExit) as err:   # checkpars() exits on error
+            conn.execute("UPDATE jobs SET status='failed', error=?, "
+                         + "finished=? WHERE id=? AND worker=?",
+                         (repr(err), time.time(), jobid, worker))
+        ntasks += 1
+    conn.close()
+    _restorepars(baseline)
+    return ntasks
+
+def sweepprogress(dbfile):
+    """Returns a dict of task counts by status, throughput and ETA
+
+    throughput is finished tasks per hour since the first task started;
+    eta is the estimated time (h) to finish the pending/running tasks.
+    """
+    conn = _sweepconnect(dbfile)
+    progress = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+    for status, count in conn.execute("SELECT status, COUNT(*) FROM jobs "
+                                      + "GROUP BY status"):
+        progress[status] = count
+    first, last = conn.execute("SELECT MIN(started), MAX(finished) FROM jobs "
+                               + "WHERE status='done'").fetchone()
+    conn.close()
+    progress['throughput'] = 0.0
+    progress['eta'] = None
+    if (first is not None) and (last > first):
+        progress['throughput'] = 3600.0*progress['done']/(last - first)
+        progress['eta'] = (progress['pending'] + progress['running']) \
+                          / progress['throughput']
+    return progress
+
+def sweepresults(dbfile):
+    """Returns a list of (pars, times, summarydata) for finished tasks"""
+    conn = _sweepconnect(dbfile)
+    results = []
+    for pars, result in conn.execute("SELECT pars, result FROM jobs "
+                                     + "WHERE status='done' ORDER BY id"):
+        result = json.loads(result)
+        results.append((json.loads(pars), np.array(result['times']),
+                        np.array(result['summary'])))
+    conn.close()
+    return results
 
 def outputdata(times, X):
     """Output data to user with header of parameter values"""
@@ -430,9 +1593,28 @@ if __name__ == "__main__":
         epilog = 'When utilized as a module, the following functions are available:\n'
         + '[setpars(**kwd) --- set parameter values by keyword]; '
         + '[checkpars() --- make sure that the number of eqns is an integer]; '
+        + '[reductionreport() --- errors and sizes of reduced stage chains]; '
         + '[getICs() --- returns vector of initial conditions]; '
         + '[gettimes() --- returns vector of times for integration evaluation]; '
-        + '[evolve(times,X0) --- evolves ODE from X0, returning X(t) at times].')
+        + '[evolve(times,X0) --- evolves ODE from X0, returning X(t) at times]; '
+        + '[tunetolerances(times,X0,accuracy) --- loosest rtol/atol for accuracy]; '
+        + '[choosesolver(times,X0) --- pick an ODE solver by stiffness]; '
+        + '[optimaldesign(parnames,nsamples,candidates,designs) --- D/A-optimal '
+        + 'sampling times and drug timing]; '
+        + '[timeofaddition(times,X0,EFAV_times,RALT_times) --- drug-time '
+        + 'sweeps sharing the drug-free trajectory]; '
+        + '[Trajectory(X) --- named stage views of X (no copies)]; '
+        + '[ResultStore(path) --- indexed archive of runs; evolve(times,X0,'
+        + 'store=...) reuses stored runs]; '
+        + '[redead(times,X,F,dDs) --- summary data for other dD values, '
+        + 'from evolve(times,X0,influx=True)]; '
+        + '[evolvesummary(times,X0) --- generator of summary data at times]; '
+        + '[addreduction(name,func) --- add func(t,X) column to evolvesummary]; '
+        + '[profilelikelihood(data,fitpars) --- parallel profile likelihoods '
+        + 'and confidence intervals]; '
+        + '[sweepinit(dbfile,parsets) --- create a job table for sweepworker()]; '
+        + '[sweepworker(dbfile) --- run tasks from a job table (any node)]; '
+        + '[sweepprogress(dbfile), sweepresults(dbfile) --- sweep status/data].')
     # Create an optional argument for each ODE parameter
     sortedlist = _Par.__dict__.items()
     sortedlist.sort()
@@ -440,6 +1622,8 @@ if __name__ == "__main__":
         if not key.startswith("_"):   # omit system/private variables
             parser.add_argument("-" + key, 
                                 help = ('{0} ({1})'.format(getattr(_Par._help,key), value)))
+    parser.add_argument("-sweepworker", metavar="DBFILE",
+                        help = 'Run tasks from the sweep job table DBFILE')
     # Parse the input arguments
     args = parser.parse_args()
     # If flag raised on commandline, set parameter value (convert string to float)
@@ -448,6 +1632,12 @@ if __name__ == "__main__":
             if (getattr(args,key)):
                 setattr(_Par, key, float(getattr(args,key)))
 
+    ######==== RUNNING AS A SWEEP WORKER ====######
+    if args.sweepworker:
+        checkpars()
+        sweepworker(args.sweepworker)
+        sys.exit()
+
     ######==== RUNNING ONCE ====######
     #--- Check the parameter values ---
     checkpars()